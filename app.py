@@ -1,17 +1,27 @@
 import streamlit as st
 import pandas as pd
-import gspread
+import numpy as np
 from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
 from datetime import datetime
+from dateutil.tz import tzlocal
 import json
+import os
+import io
+import gzip
+import shutil
 
 # ==========================================
 # 👇 你的表格链接
 SHEET_URL = "https://docs.google.com/spreadsheets/d/1Rxp_7Ash8-B9hfwlci-DbSZ976yNy4usVOkYe5xIG70/edit?gid=0#gid=0"
 # ==========================================
 
+def get_secret(name):
+    # 统一读取 Secrets（本地没有 secrets.toml 时访问 st.secrets 会抛异常）
+    try:
+        return st.secrets.get(name)
+    except FileNotFoundError:
+        return None
+
 # --- 1. 统一认证中心 (同时搞定表格和网盘) ---
 @st.cache_resource
 def get_creds():
@@ -22,80 +32,263 @@ def get_creds():
     ]
     
     # 尝试从 Secrets 读取
-    if "google_key" in st.secrets:
-        secret_val = st.secrets["google_key"]
+    secret_val = get_secret("google_key")
+    if secret_val is not None:
         # 情况A: 是字符串（被引号包围）
         if isinstance(secret_val, str):
             try:
                 # 兼容 JSON 字符串
                 key_dict = json.loads(secret_val)
                 return Credentials.from_service_account_info(key_dict, scopes=SCOPES)
-            except:
-                # 兼容单引号包裹的纯文本
-                try:
-                    # 极其暴力的容错：如果它是单引号包裹的，Streamlit读取时可能还是字符串
-                    # 我们尝试把它当做dict结构处理（这里简化处理，通常上面的json.loads能搞定）
-                    pass 
-                except:
-                    pass
+            except (ValueError, KeyError) as e:
+                st.error(f"Secrets 中的 google_key 无法解析: {e}")
+                return None
         # 情况B: 已经被识别为字典对象
         elif isinstance(secret_val, dict):
             return Credentials.from_service_account_info(secret_val, scopes=SCOPES)
     
-    # 本地模式
-    try:
-        return Credentials.from_service_account_file("key.json", scopes=SCOPES)
-    except:
-        return None
+    # 本地模式：先判断文件是否存在，不靠抛异常走分支
+    if os.path.exists("key.json"):
+        try:
+            return Credentials.from_service_account_file("key.json", scopes=SCOPES)
+        except ValueError as e:
+            st.error(f"key.json 无法解析: {e}")
+            return None
+
+    st.error("未找到可用的 Google 凭证（Secrets 或 key.json）")
+    return None
 
 # --- 2. 核心功能：表格操作 ---
-def get_sheet_client():
+@st.cache_resource
+def get_worksheet():
+    # 缓存打开后的工作表，避免每次操作都重新 open_by_url（一次元数据请求）
     creds = get_creds()
     if creds:
+        # 延迟导入，缩短冷启动时间
+        import gspread
         client = gspread.authorize(creds)
         return client.open_by_url(SHEET_URL).sheet1
     return None
 
+def get_sheet_client():
+    sheet = get_worksheet()
+    if sheet is None:
+        # 认证失败时不要把 None 一直缓存下去（凭证和工作表一起清掉），下次再重试
+        get_creds.clear()
+        get_worksheet.clear()
+    return sheet
+
+def sheet_range(sheet, cell_range=None):
+    # 生成带引号的 A1 区域名，兼容含空格的工作表名
+    from gspread.utils import absolute_range_name
+    return absolute_range_name(sheet.title, cell_range)
+
+# 表格读取缓存的有效期（秒）
+DATA_TTL = 60
+
+# created_at 显示和搜索用的文本格式
+CREATED_AT_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def parse_created_at(col):
+    # 新记录存的是 Unix 时间戳（整数），旧记录是服务器本地时间的 str(datetime) 文本
+    # 统一转成本地时间（不带时区），与旧记录保持同一时间基准
+    nums = pd.to_numeric(col, errors="coerce")
+    local = pd.to_datetime(nums, unit="s", utc=True).dt.tz_convert(tzlocal()).dt.tz_localize(None)
+    legacy = pd.to_datetime(col.where(nums.isna()), errors="coerce", format="mixed")
+    parsed = local.fillna(legacy)
+    blank = col.isna() | (col.astype(str).str.strip() == "")
+    if (parsed.isna() & ~blank).any():
+        # 有无法识别的旧值时保留为文本列，不丢数据：时间戳换成本地时间文本，其余原样保留
+        text = col.where(~blank, "").astype(str)
+        return text.where(nums.isna(), local.dt.strftime(CREATED_AT_FORMAT))
+    return parsed
+
+def to_epoch(col):
+    # 本地时间转回 Unix 时间戳（整列向量化计算）
+    utc = col.dt.tz_localize(tzlocal(), nonexistent="shift_forward").dt.tz_convert("UTC")
+    return ((utc - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)).astype("Int64")
+
+@st.cache_data(ttl=DATA_TTL, show_spinner=False)
 def get_data():
     sheet = get_sheet_client()
     if sheet:
-        try:
-            data = sheet.get_all_records()
-            return pd.DataFrame(data)
-        except:
+        # 一次取回未格式化的原始值（数字直接是数字），直接按列构建 DataFrame
+        resp = sheet.spreadsheet.values_get(
+            sheet_range(sheet),
+            params={"valueRenderOption": "UNFORMATTED_VALUE", "dateTimeRenderOption": "FORMATTED_STRING"},
+        )
+        values = resp.get("values", [])
+        if not values:
             return pd.DataFrame()
+        header, *rows = values
+        # API 会省略行尾的空单元格，按表头补齐
+        rows = [row + [""] * (len(header) - len(row)) for row in rows]
+        df = pd.DataFrame(rows, columns=header)
+        if "rating" in df.columns:
+            df["rating"] = pd.to_numeric(df["rating"], errors="coerce")
+        if "created_at" in df.columns:
+            df["created_at"] = parse_created_at(df["created_at"])
+        # 转成 Arrow 类型，data_editor 序列化时基本不用再逐格转换
+        text_cols = df.select_dtypes(include=["object", "string"]).columns
+        df = df.astype({c: "string[pyarrow]" for c in text_cols})
+        if "rating" in df.columns:
+            df = df.astype({"rating": "float64[pyarrow]"})
+        return df
     return pd.DataFrame()
 
+def to_cell_data(value):
+    # 按 RAW 的语义把单元格值转换成 CellData（空字符串即清空）
+    if value == "" or value is None:
+        return {}
+    if isinstance(value, (bool, np.bool_)):
+        return {"userEnteredValue": {"boolValue": bool(value)}}
+    if isinstance(value, (int, float, np.number)):
+        return {"userEnteredValue": {"numberValue": float(value)}}
+    return {"userEnteredValue": {"stringValue": str(value)}}
+
 def update_entire_sheet(df):
     sheet = get_sheet_client()
     if sheet:
-        sheet.clear()
-        # gspread 需要将 dataframe 转换为 list 列表
+        # 时间列写回为 Unix 时间戳
+        df = df.copy()
+        for col in df.select_dtypes(include="datetime").columns:
+            df[col] = to_epoch(df[col])
+        # gspread 需要将 dataframe 转换为 list 列表（空值写成空字符串）
+        df = df.astype(object).where(df.notna(), "")
         val_list = [df.columns.values.tolist()] + df.values.tolist()
-        sheet.update(val_list)
+        rows = [{"values": [to_cell_data(v) for v in row]} for row in val_list]
+        # 一次 spreadsheets.batchUpdate 完成整表覆盖：
+        # 先补足网格行数，再写入新表（同时清掉这些行里多余的列），最后删掉新表之后的所有旧行
+        # 不依赖缓存里的行数，别处新增的行也会被清掉
+        sheet.spreadsheet.batch_update({"requests": [
+            {"appendDimension": {"sheetId": sheet.id, "dimension": "ROWS", "length": len(val_list)}},
+            {"updateCells": {
+                "range": {"sheetId": sheet.id, "startRowIndex": 0, "endRowIndex": len(val_list), "startColumnIndex": 0},
+                "rows": rows,
+                "fields": "userEnteredValue",
+            }},
+            {"deleteDimension": {"range": {"sheetId": sheet.id, "dimension": "ROWS", "startIndex": len(val_list)}}},
+        ]})
+        # 写入后让读取缓存失效
+        get_data.clear()
+        st.session_state.pop("df_cache", None)
+
+def load_table():
+    # 刚追加过记录时，直接用本地合并好的表，不再重新拉取整张表
+    cached = st.session_state.get("df_cache")
+    if cached is not None:
+        df, saved_at = cached
+        # 超过 TTL 后改为重新读取最新数据
+        if (datetime.now() - saved_at).total_seconds() < DATA_TTL:
+            return df
+        del st.session_state["df_cache"]
+    # 读取失败时不能让异常结果进入 get_data 的缓存，所以在这里捕获
+    try:
+        return get_data()
+    except Exception as e:
+        st.error(f"读取表格失败: {e}")
+        return pd.DataFrame()
+
+def merge_appended_rows(df, rows):
+    if df.empty or any(len(row) != len(df.columns) for row in rows):
+        # 无法对齐表头时退回到重新读取
+        get_data.clear()
+        st.session_state.pop("df_cache", None)
+        return
+    new_df = pd.DataFrame(rows, columns=df.columns)
+    if "created_at" in new_df.columns:
+        new_df["created_at"] = parse_created_at(new_df["created_at"])
+    new_df = new_df.astype(df.dtypes.to_dict())
+    merged = pd.concat([df, new_df], ignore_index=True)
+    st.session_state.df_cache = (merged, datetime.now())
+
+# 待写入的新记录先攒在 session 里，批量一次 append_rows 写入
+PENDING_FLUSH_SIZE = 10
+
+def flush_pending_rows():
+    pending = st.session_state.get("pending", [])
+    if not pending:
+        return 0
+    sheet = get_sheet_client()
+    if sheet:
+        # 先取写入前的表（通常命中缓存），避免写入后再读导致新行重复
+        base_df = load_table()
+        from gspread.exceptions import APIError
+        try:
+            sheet.append_rows(pending, value_input_option="RAW")
+        except APIError as e:
+            # 写入失败（如配额 429）时保留队列，交给调用方提示并重试
+            st.error(f"写入表格失败: {e}")
+            return 0
+        count = len(pending)
+        st.session_state.pending = []
+        # 当前会话直接用本地合并的表；全局读取缓存仍要失效，否则其他会话会拿旧表保存覆盖掉新行
+        merge_appended_rows(base_df, pending)
+        get_data.clear()
+        return count
+    return 0
 
 # --- 3. 核心功能：网盘上传 ---
-def upload_file_to_drive(uploaded_file):
+# Drive 的 multipart 上传只适合 5MB 以内的文件，更大的文件用 resumable 分块上传
+RESUMABLE_THRESHOLD = 5 * 1024 * 1024
+
+# 这些类型压缩率高，上传前先 gzip
+COMPRESSIBLE_TYPES = ("application/json", "application/xml", "application/javascript")
+COMPRESSIBLE_EXTS = (".txt", ".csv", ".json", ".md", ".srt", ".ass", ".xml", ".html")
+
+def is_compressible(uploaded_file):
+    mimetype = uploaded_file.type or ""
+    return (
+        mimetype.startswith("text/")
+        or mimetype in COMPRESSIBLE_TYPES
+        or uploaded_file.name.lower().endswith(COMPRESSIBLE_EXTS)
+    )
+
+def get_drive_service():
+    # 服务对象底层的 httplib2 连接不是线程安全的，不能在多个会话间共享，每次上传单独构建
+    # （凭证已缓存；新版 googleapiclient 自带 Discovery 文档，build() 不发网络请求）
     creds = get_creds()
-    
+    if creds:
+        from googleapiclient.discovery import build
+        return build('drive', 'v3', credentials=creds)
+    return None
+
+def upload_file_to_drive(uploaded_file):
     # 从 Secrets 获取文件夹 ID
-    if "drive_folder_id" not in st.secrets:
+    folder_id = get_secret("drive_folder_id")
+    if not folder_id:
         st.error("请在 Secrets 中配置 'drive_folder_id'")
         return None
-        
-    folder_id = st.secrets["drive_folder_id"]
     
-    if creds and folder_id:
-        # 构建 Drive 服务
-        service = build('drive', 'v3', credentials=creds)
-        
+    service = get_drive_service()
+    if service is None:
+        # 凭证缺失时不缓存，下次重试
+        get_creds.clear()
+    if service and folder_id:
+        from googleapiclient.http import MediaIoBaseUpload
+
+        file_name = uploaded_file.name
+        stream = uploaded_file
+        mimetype = uploaded_file.type
+        size = uploaded_file.size
+
+        # 文本类文件先 gzip 压缩再上传，减少上行流量（zip/mp3/jpg 等已压缩格式不处理）
+        if is_compressible(uploaded_file):
+            stream = io.BytesIO()
+            with gzip.GzipFile(fileobj=stream, mode='wb') as gz:
+                shutil.copyfileobj(uploaded_file, gz)
+            stream.seek(0)
+            file_name += ".gz"
+            mimetype = "application/gzip"
+            size = stream.getbuffer().nbytes
+
         file_metadata = {
-            'name': uploaded_file.name,
+            'name': file_name,
             'parents': [folder_id]
         }
         
-        # 转换文件流
-        media = MediaIoBaseUpload(uploaded_file, mimetype=uploaded_file.type)
+        # 转换文件流：小文件单次 multipart 上传；大文件分块上传，出错时可以按块重试
+        media = MediaIoBaseUpload(stream, mimetype=mimetype, resumable=size > RESUMABLE_THRESHOLD)
         
         # 执行上传
         try:
@@ -111,7 +304,54 @@ def upload_file_to_drive(uploaded_file):
             return None
     return None
 
-# --- 4. 页面主逻辑 ---
+# --- 4. 搜索 ---
+def text_mask(text_series, term, length):
+    # 按列向量化匹配，再做 OR 合并（比逐行 apply 快得多）
+    mask = np.zeros(length, dtype=bool)
+    for series in text_series:
+        mask |= series.str.contains(term, case=False, regex=False, na=False).to_numpy(dtype=bool)
+    return mask
+
+def filter_by_search(df, search_term):
+    # 多个关键词用空格分隔：0-10 之间的数字按评分筛选（多个数字之间为 OR），其余关键词匹配文字，彼此之间为 AND
+    text_cols = df.select_dtypes(include=["object", "string"]).columns
+    # 纯数字关键词（如番号 1080）只匹配普通文本列，不去匹配链接和时间里的数字
+    plain_series = [df[col] for col in text_cols if col != "file_link"]
+    text_series = [df[col] for col in text_cols]
+    # 时间列按显示格式转成文本参与匹配（如搜索 2024-05），每次搜索只格式化一次
+    text_series += [df[col].dt.strftime(CREATED_AT_FORMAT) for col in df.select_dtypes(include="datetime").columns]
+    has_rating = "rating" in df.columns
+    mask = np.ones(len(df), dtype=bool)
+    numbers = []
+    for token in search_term.split():
+        try:
+            number = float(token)
+        except ValueError:
+            mask &= text_mask(text_series, token, len(df))
+            continue
+        if has_rating and np.isfinite(number) and 0 <= number <= 10:
+            numbers.append(number)
+        else:
+            mask &= text_mask(plain_series, token, len(df))
+
+    if numbers:
+        ratings = df["rating"].to_numpy(dtype="float64", na_value=np.nan)
+        mask &= np.isin(ratings, numbers)
+    return mask
+
+def existing_titles():
+    # 复用已缓存的整表数据做查重，不再额外请求一次标题列
+    df = load_table()
+    titles = set()
+    if "title" in df.columns:
+        titles.update(df["title"].dropna().astype("string").str.strip())
+    titles.update(str(row[0]).strip() for row in st.session_state.get("pending", []))
+    return titles
+
+# --- 5. 页面主逻辑 ---
+# 数据管理表格每页显示的行数
+PAGE_SIZE = 50
+
 def main():
     st.set_page_config(page_title="资源管理库 V3.0", page_icon="💾", layout="wide")
     st.title("💾 我的私人资源库")
@@ -120,27 +360,29 @@ def main():
 
     # === Tab 1: 录入 ===
     with tab1:
-        with st.form("entry_form", clear_on_submit=True):
+        # 不用 clear_on_submit：被拒绝（如重名）时保留已填内容，保存成功后换一组控件 key 来清空表单
+        form_id = st.session_state.setdefault("form_id", 0)
+        with st.form(f"entry_form_{form_id}"):
             col1, col2 = st.columns([3, 1])
             with col1:
-                title = st.text_input("标题/番号")
+                title = st.text_input("标题/番号", key=f"title_{form_id}")
             with col2:
                 # 👇 这里记得保留你之前改好的分类（网黄、VAM那些）
-                category = st.selectbox("分类", ["刘备", "ASMR", "AV", "本子", "动画", "VAM", "l2d", "网黄"])
+                category = st.selectbox("分类", ["刘备", "ASMR", "AV", "本子", "动画", "VAM", "l2d", "网黄"], key=f"category_{form_id}")
             
-            rating = st.slider("评分", 0.0, 10.0, 7.5, 0.5)
-            tags = st.text_input("标签 (空格分隔)")
-            review = st.text_area("短评", height=100)
+            rating = st.slider("评分", 0.0, 10.0, 7.5, 0.5, key=f"rating_{form_id}")
+            tags = st.text_input("标签 (空格分隔)", key=f"tags_{form_id}")
+            review = st.text_area("短评", height=100, key=f"review_{form_id}")
 
             # --- 👇 V4.0 新增逻辑开始 ---
             st.markdown("---")
             st.write("📂 **资源挂载 (二选一)**")
             
             # 方式 A: 直接上传 (适合图片/Epub/小文件)
-            uploaded_file = st.file_uploader("方式A: 直接上传文件 (限小文件)", type=None)
+            uploaded_file = st.file_uploader("方式A: 直接上传文件 (限小文件)", type=None, key=f"file_{form_id}")
             
             # 方式 B: 手动粘贴链接 (适合大文件/PDF/视频)
-            manual_link = st.text_input("方式B: 手动粘贴 Google Drive 链接 (大文件推荐)")
+            manual_link = st.text_input("方式B: 手动粘贴 Google Drive 链接 (大文件推荐)", key=f"link_{form_id}")
             
             # 提示语
             if rating >= 8.0:
@@ -152,6 +394,8 @@ def main():
             if submitted:
                 if not title:
                     st.warning("标题不能为空")
+                elif title.strip() in existing_titles():
+                    st.warning(f"已存在同名记录: {title}")
                 else:
                     with st.spinner("正在处理..."):
                         final_link = ""
@@ -172,25 +416,45 @@ def main():
                         elif manual_link:
                             final_link = manual_link
                         
-                        # 写入表格
-                        sheet = get_sheet_client()
-                        if sheet:
-                            # 构造数据行
-                            row = [title, category, tags, rating, review, str(datetime.now()), final_link]
-                            sheet.append_row(row)
-                            st.success(f"✅ 记录已保存: {title}")
+                        # 构造数据行，先放入待写入队列
+                        row = [title, category, tags, rating, review, int(datetime.now().timestamp()), final_link]
+                        st.session_state.setdefault("pending", []).append(row)
+                        # 记录已入队，清空表单
+                        st.session_state.form_id = form_id + 1
+                        # 攒够一批自动写入表格
+                        if len(st.session_state.pending) >= PENDING_FLUSH_SIZE:
+                            if flush_pending_rows():
+                                st.success(f"✅ 记录已保存: {title}")
+                                st.rerun()
+                            else:
+                                st.error("自动同步失败，记录仍在待同步队列中，请检查表格连接后手动同步。")
+                        else:
+                            st.success(f"✅ 已加入待同步队列: {title}")
                             st.rerun()
 
+        # 手动同步待写入的记录
+        pending_count = len(st.session_state.get("pending", []))
+        if pending_count:
+            st.warning(f"⚠️ 有 {pending_count} 条记录尚未同步到表格，刷新或关闭页面会丢失（已上传的文件会留在网盘里）。")
+            if st.button(f"☁️ 同步 {pending_count} 条待写入记录"):
+                with st.spinner("正在同步..."):
+                    saved = flush_pending_rows()
+                    if saved:
+                        st.success(f"✅ 已写入 {saved} 条记录")
+                        st.rerun()
+                    else:
+                        st.error("同步失败，请检查表格连接。")
+
     # === Tab 2: 管理 ===
     with tab2:
         st.info("💡 提示：双击单元格修改。如果包含文件链接，可以直接点击跳转下载。")
-        df = get_data()
+        df = load_table()
         
         if not df.empty:
             search_term = st.text_input("🔍 搜索", placeholder="输入关键词...")
             
             if search_term:
-                mask = df.apply(lambda x: x.astype(str).str.contains(search_term, case=False).any(), axis=1)
+                mask = filter_by_search(df, search_term)
                 display_df = df[mask]
             else:
                 display_df = df
@@ -199,13 +463,29 @@ def main():
             if "file_link" not in display_df.columns:
                 display_df["file_link"] = ""
 
+            # 分页：只把当前页交给 data_editor，减少每次重跑的序列化量
+            page_count = max((len(display_df) - 1) // PAGE_SIZE + 1, 1)
+            page = 1
+            if page_count > 1:
+                page = st.number_input("页码", min_value=1, max_value=page_count, value=1, step=1, key="page")
+                st.caption(f"共 {len(display_df)} 条，{page_count} 页（翻页前请先保存修改）")
+            start = (page - 1) * PAGE_SIZE
+            end = start + PAGE_SIZE
+            page_df = display_df.iloc[start:end]
+
+            # 时间列含无法识别的旧值时是文本列，DatetimeColumn 不能编辑文本列
+            if "created_at" in page_df.columns and pd.api.types.is_datetime64_any_dtype(page_df["created_at"]):
+                created_at_config = st.column_config.DatetimeColumn("创建时间", format="YYYY-MM-DD HH:mm")
+            else:
+                created_at_config = st.column_config.TextColumn("创建时间")
+
             # 使用 Column Config 优化链接显示
-            edited_df = st.data_editor(
-                display_df,
+            edited_page_df = st.data_editor(
+                page_df,
                 num_rows="dynamic",
                 use_container_width=True,
                 height=500,
-                key="editor",
+                key=f"editor_{page}",
                 column_config={
                     "file_link": st.column_config.LinkColumn(
                         "资源链接",
@@ -214,6 +494,7 @@ def main():
                         max_chars=100,
                         display_text="🔗 下载文件"
                     ),
+                    "created_at": created_at_config,
                     "rating": st.column_config.NumberColumn(
                         "评分",
                         min_value=0,
@@ -229,6 +510,11 @@ def main():
                     if search_term:
                         st.warning("请清除搜索词后再保存！")
                     else:
+                        # 把编辑过的当前页拼回整表（页内新增/删除的行也会保留）
+                        edited_df = pd.concat(
+                            [display_df.iloc[:start], edited_page_df, display_df.iloc[end:]],
+                            ignore_index=True,
+                        )
                         update_entire_sheet(edited_df)
                         st.success("更新完成！")
                         st.rerun()